@@ -7,45 +7,103 @@ Use a .env file (or environment variables) to set BOT_TOKEN and OPENAI_API_KEY.
 """
 
 import os
+import functools
+import hashlib
+import queue
 import sqlite3
 import logging
-import datetime
 import math
+import random
 import re
+import shutil
+import tempfile
+import threading
 import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from enum import Enum, auto
+from pathlib import Path
+from typing import Optional
 
 from dotenv import load_dotenv
 load_dotenv()
 
+import requests
 import telebot
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, ForceReply, InlineKeyboardMarkup, InlineKeyboardButton
 from openai import OpenAI, RateLimitError, APIError
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("speakify")
+# Per-update INFO logs are only emitted when DEBUG is set; warnings and errors always are.
+logger.setLevel(logging.INFO if os.getenv("DEBUG") else logging.WARNING)
 
 # --- Bot & Admin Configuration (from env) ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
+ADMIN_IDS = frozenset(int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip())
 QUESTIONS_PER_PAGE = int(os.getenv("QUESTIONS_PER_PAGE", "5"))
-BROADCAST_DELAY_SECONDS = float(os.getenv("BROADCAST_DELAY_SECONDS", "0.1"))
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "30"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))
+BROADCAST_CHUNK_SIZE = 10000
 MAX_VOICE_DURATION_SECONDS = int(os.getenv("MAX_VOICE_DURATION_SECONDS", "180"))
+AI_WORKER_COUNT = int(os.getenv("AI_WORKER_COUNT", "4"))
+# Every queued job holds a voice file in VOICE_TMP_DIR, so the backlog is capped.
+AI_QUEUE_SIZE = int(os.getenv("AI_QUEUE_SIZE", "32"))
+# Voice answers are only needed until they are transcribed, so keep them in RAM-backed tmpfs when available.
+VOICE_TMP_DIR = os.getenv("VOICE_TMP_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "2048"))
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", "86400"))
 DB_NAME = os.getenv("DB_NAME", "ielts_questions.db")
+# Size of telebot's handler worker pool; a slow OpenAI round-trip only occupies one worker.
+BOT_WORKER_THREADS = int(os.getenv("BOT_WORKER_THREADS", "16"))
 
 if not BOT_TOKEN:
-    logging.critical("CRITICAL ERROR: BOT_TOKEN is not set. Exiting.")
+    logger.critical("CRITICAL ERROR: BOT_TOKEN is not set. Exiting.")
     raise SystemExit(1)
 
 if not OPENAI_API_KEY:
-    logging.warning("WARNING: OPENAI_API_KEY is not set. AI features will not work.")
+    logger.warning("WARNING: OPENAI_API_KEY is not set. AI features will not work.")
     openai_client = None
 else:
     openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# One pooled keep-alive session shared by every Telegram API call and file
+# download, so handler and broadcast threads reuse TLS connections.
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    # Only connection failures are retried: the request never reached Telegram, so re-sending a POST
+    # cannot duplicate a message. Read timeouts, 5xx and 429 go back to telebot and the app-level retry_after handling.
+    max_retries=Retry(total=None, connect=3, read=0, redirect=0, status=0, backoff_factor=0.5),
+))
+telebot.apihelper.CUSTOM_REQUEST_SENDER = _HTTP_SESSION.request
+# urllib3 logs every connect retry at WARNING with the request path, which embeds the bot token.
+logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
+
+# Exceptions raised on telebot's handler worker threads are handler bugs, not polling
+# failures: log them here so they never reach the polling supervisor's backoff.
+# On the main thread (getUpdates errors) a 429 waits out Telegram's retry_after.
+class _HandlerExceptionHandler(telebot.ExceptionHandler):
+    def handle(self, exception):
+        if threading.current_thread() is threading.main_thread():
+            if isinstance(exception, telebot.apihelper.ApiTelegramException) and exception.error_code == 429:
+                retry_after = (exception.result_json or {}).get("parameters", {}).get("retry_after", 1)
+                logger.warning("Polling hit flood control; sleeping %ss.", retry_after)
+                time.sleep(retry_after)
+                return True
+            return False
+        logger.error("Unhandled exception in update handler: %s", exception, exc_info=exception)
+        return True
+
+bot = telebot.TeleBot(BOT_TOKEN, threaded=True, num_threads=BOT_WORKER_THREADS, exception_handler=_HandlerExceptionHandler())
 
 class AdminState(Enum):
     NONE = auto()
@@ -67,33 +125,135 @@ class UserState(Enum):
     AWAITING_ADMIN_MESSAGE = auto()
     AWAITING_VOICE_ANSWER = auto()
 
-ADMIN_STATES = {}
-USER_STATES = {}
-USER_CURRENT_QUESTION = {}
+@dataclass(slots=True)
+class UserSession:
+    user_state: Optional[UserState] = None
+    admin_state: Optional[AdminState] = None
+    current_question: Optional[str] = None
+
+# Per-user conversation state, keyed by chat/user id (identical in private chats).
+SESSIONS = defaultdict(UserSession)
+
+def _user_state(key):
+    session = SESSIONS.get(key)
+    return session.user_state if session else None
+
+def _admin_state(key):
+    session = SESSIONS.get(key)
+    return session.admin_state if session else None
+
+# --- Lookup Tables ---
+_ADMIN_ID_RE = re.compile(r'^\d+:\d+$')
+_COL_BY_TABLE = {"part1_questions": "question", "part2_topics": "topic", "part3_discussions": "discussion"}
+# Pagination callbacks refer to tables by their single-digit index in TABLES.
+TABLES = tuple(_COL_BY_TABLE)
+_PAGE_CALLBACK_RE = re.compile(r'p(\d+)([0-2])', re.ASCII)
+_TABLE_INDEX = {table_name: index for index, table_name in enumerate(TABLES)}
+_TABLE_BY_PART = {1: "part1_questions", 2: "part2_topics", 3: "part3_discussions"}
+_PART_NAME_BY_PART = {1: "Part 1 Question", 2: "Part 2 Topic", 3: "Part 3 Discussion"}
+_PART_NUMBER_BY_TABLE = {"part1_questions": "1", "part2_topics": "2", "part3_discussions": "3"}
+_LIST_TITLE_BY_TABLE = {"part1_questions": "Part 1 Questions", "part2_topics": "Part 2 Topics", "part3_discussions": "Part 3 Discussions"}
+_TABLE_BY_PART_BUTTON = {"Part 1": "part1_questions", "Part 2": "part2_topics", "Part 3": "part3_discussions"}
+_TABLE_BY_MENU_BUTTON = {"1️⃣ Part 1": "part1_questions", "2️⃣ Part 2": "part2_topics", "3️⃣ Part 3": "part3_discussions"}
+_ADMIN_ACTION_BY_BUTTON = {
+    "➕ Add Question": AdminState.SELECT_ADD_CATEGORY,
+    "➖ Delete Question": AdminState.SELECT_DELETE_CATEGORY,
+    "📄 List Questions": AdminState.SELECT_LIST_CATEGORY,
+}
+_ADD_STATE_BY_PART_BUTTON = {"Part 1": AdminState.AWAITING_ADD_PART1, "Part 2": AdminState.AWAITING_ADD_PART2, "Part 3": AdminState.AWAITING_ADD_PART3}
+_DELETE_STATE_BY_PART_BUTTON = {"Part 1": AdminState.AWAITING_DELETE_ID_PART1, "Part 2": AdminState.AWAITING_DELETE_ID_PART2, "Part 3": AdminState.AWAITING_DELETE_ID_PART3}
+_TABLE_BY_ADMIN_STATE = {
+    AdminState.AWAITING_ADD_PART1: "part1_questions", AdminState.AWAITING_DELETE_ID_PART1: "part1_questions",
+    AdminState.AWAITING_ADD_PART2: "part2_topics", AdminState.AWAITING_DELETE_ID_PART2: "part2_topics",
+    AdminState.AWAITING_ADD_PART3: "part3_discussions", AdminState.AWAITING_DELETE_ID_PART3: "part3_discussions"
+}
 
 # --- Database Layer ---
-def execute_db_query(query, params=(), fetch=None):
+# One writer connection (serialized by a lock) plus a pool of read-only
+# connections, opened once in create_database() and kept for the bot's lifetime.
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(os.cpu_count() or 4)))
+_WRITE_CONN = None
+_WRITE_LOCK = threading.Lock()
+_READ_POOL = None
+
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=memory",
+    "PRAGMA foreign_keys=ON",
+)
+
+# SQL for every (operation, table) pair, built once so each connection's
+# statement cache keeps the prepared statements hot.
+_QUERY_TEMPLATES = {
+    "get_random": "SELECT {column} FROM {table} ORDER BY id LIMIT 1 OFFSET ?",
+    "get_by_id": "SELECT {column} FROM {table} WHERE id = ?",
+    "insert": "INSERT OR IGNORE INTO {table} ({column}) VALUES (?)",
+    "delete": "DELETE FROM {table} WHERE id = ?",
+    "get_page": "SELECT id, {column} FROM {table} ORDER BY id LIMIT ? OFFSET ?",
+    "count": "SELECT COUNT(id) FROM {table}",
+}
+QUERIES = {
+    (operation, table): template.format(table=table, column=column)
+    for operation, template in _QUERY_TEMPLATES.items()
+    for table, column in _COL_BY_TABLE.items()
+}
+
+def _open_connection(read_only=False):
+    if read_only:
+        # as_uri() percent-encodes the path, so names containing '?', '#' or '%' still open the writer's file.
+        conn = sqlite3.connect(f"{Path(DB_NAME).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False, cached_statements=256)
+    else:
+        # isolation_level="IMMEDIATE" makes every write take the write lock upfront (BEGIN IMMEDIATE).
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level="IMMEDIATE", cached_statements=256)
+        # journal_mode is persistent in the database file and can only be switched by a writable connection.
+        conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _init_connections():
+    global _WRITE_CONN, _READ_POOL
+    if _WRITE_CONN is None:
+        _WRITE_CONN = _open_connection()
+    if _READ_POOL is None:
+        # Read-only connections require the database file to exist, so they are opened after the writer.
+        _READ_POOL = queue.Queue()
+        for _ in range(DB_READ_POOL_SIZE):
+            _READ_POOL.put(_open_connection(read_only=True))
+
+@contextmanager
+def _acquire_read():
+    conn = _READ_POOL.get()
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            if fetch == "one": return cursor.fetchone()
-            if fetch == "all": return cursor.fetchall()
-            conn.commit()
+        yield conn
+    finally:
+        _READ_POOL.put(conn)
+
+def execute_db_query(query, params=(), fetch=None, many=False):
+    try:
+        if fetch in ("one", "all"):
+            with _acquire_read() as conn:
+                cursor = conn.execute(query, params)
+                return cursor.fetchone() if fetch == "one" else cursor.fetchall()
+        with _WRITE_LOCK, _WRITE_CONN:
+            cursor = _WRITE_CONN.executemany(query, params) if many else _WRITE_CONN.execute(query, params)
             return cursor.rowcount
     except sqlite3.IntegrityError:
-        logging.warning(f"Database IntegrityError on query '{query[:30]}...'. Likely a duplicate entry.")
+        logger.warning("Database IntegrityError on query '%.30s...'. Likely a duplicate entry.", query)
         return 0
     except sqlite3.Error as e:
-        logging.error(f"Database error on query '{query[:30]}...': {e}")
+        logger.error("Database error on query '%.30s...': %s", query, e)
         return None if fetch else -1
 
 def create_database():
+    _init_connections()
     execute_db_query('CREATE TABLE IF NOT EXISTS part1_questions (id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT NOT NULL UNIQUE)')
     execute_db_query('CREATE TABLE IF NOT EXISTS part2_topics (id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL UNIQUE)')
     execute_db_query('CREATE TABLE IF NOT EXISTS part3_discussions (id INTEGER PRIMARY KEY AUTOINCREMENT, discussion TEXT NOT NULL UNIQUE)')
     execute_db_query('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER UNIQUE NOT NULL, first_seen DATETIME, last_interaction DATETIME)')
-    logging.info("Database tables checked/created successfully.")
+    logger.info("Database tables checked/created successfully.")
 
 def insert_sample_data():
     sample_data = {
@@ -102,60 +262,92 @@ def insert_sample_data():
         "part3_discussions": [(f"Sample Part 3 Discussion {i}",) for i in range(1, 15)]
     }
     for table, data in sample_data.items():
-        count = execute_db_query(f"SELECT COUNT(*) FROM {table}", fetch="one")
+        count = execute_db_query(QUERIES["count", table], fetch="one")
         if count and count[0] == 0:
-            column = "question" if table == "part1_questions" else "topic" if table == "part2_topics" else "discussion"
-            for item in data:
-                execute_db_query(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", item)
-            logging.info(f"Inserted sample data into {table}.")
+            execute_db_query(QUERIES["insert", table], data, many=True)
+            logger.info("Inserted sample data into %s.", table)
+
+# Per-table row count (random sampling, pagination, stats).
+# Invalidated whenever a question is added or deleted; the per-table generation
+# stops a COUNT that raced with that write from storing its stale result.
+_ITEM_COUNT_CACHE = {}
+_ITEM_COUNT_GENERATION = defaultdict(int)
+_ITEM_COUNT_LOCK = threading.Lock()
+
+def _invalidate_table_cache(table_name):
+    with _ITEM_COUNT_LOCK:
+        _ITEM_COUNT_GENERATION[table_name] += 1
+        _ITEM_COUNT_CACHE.pop(table_name, None)
 
 def get_random_question(table_name):
-    column = {"part1_questions": "question", "part2_topics": "topic", "part3_discussions": "discussion"}.get(table_name)
-    if not column: return "Invalid category."
-    item = execute_db_query(f"SELECT {column} FROM {table_name} ORDER BY RANDOM() LIMIT 1", fetch="one")
-    return item[0] if item else "No questions found."
+    query = QUERIES.get(("get_random", table_name))
+    if not query: return "Invalid category."
+    for attempt in range(2):
+        count = get_item_count(table_name)
+        if count <= 0: return "No questions found."
+        # A uniform offset into the id-ordered primary key walks the index without sorting the table.
+        item = execute_db_query(query, (random.randrange(count),), fetch="one")
+        if item: return item[0]
+        # An offset past the end means the cached count is stale; recount once and retry.
+        _invalidate_table_cache(table_name)
+    return "No questions found."
 
 def get_question_by_id(table_name, question_id):
-    column = {"part1_questions": "question", "part2_topics": "topic", "part3_discussions": "discussion"}.get(table_name)
-    if not column: return "Invalid category."
-    item = execute_db_query(f"SELECT {column} FROM {table_name} WHERE id = ?", (question_id,), fetch="one")
+    query = QUERIES.get(("get_by_id", table_name))
+    if not query: return "Invalid category."
+    item = execute_db_query(query, (question_id,), fetch="one")
     return item[0] if item else f"No item found with ID {question_id}."
 
 def add_question_to_db(table_name, text):
     text = text.strip()
     if not text:
         return False, "Input cannot be empty."
-    column = {"part1_questions": "question", "part2_topics": "topic", "part3_discussions": "discussion"}.get(table_name)
-    if not column: return False, "Invalid table name."
-    rowcount = execute_db_query(f"INSERT OR IGNORE INTO {table_name} ({column}) VALUES (?)", (text,))
-    if rowcount is not None and rowcount > 0: return True, "Question added successfully!"
+    query = QUERIES.get(("insert", table_name))
+    if not query: return False, "Invalid table name."
+    rowcount = execute_db_query(query, (text,))
+    if rowcount is not None and rowcount > 0:
+        _invalidate_table_cache(table_name)
+        return True, "Question added successfully!"
     elif rowcount == 0: return False, "Question already exists."
     else: return False, "An error occurred."
 
 def delete_question_from_db(table_name, question_id):
-    rowcount = execute_db_query(f"DELETE FROM {table_name} WHERE id = ?", (question_id,))
-    if rowcount is not None and rowcount > 0: return True, "Question deleted successfully!"
+    query = QUERIES.get(("delete", table_name))
+    if not query: return False, "Invalid table name."
+    rowcount = execute_db_query(query, (question_id,))
+    if rowcount is not None and rowcount > 0:
+        _invalidate_table_cache(table_name)
+        return True, "Question deleted successfully!"
     elif rowcount == 0: return False, "Question ID not found."
     else: return False, "An error occurred."
 
-def get_all_questions(table_name):
-    column = {"part1_questions": "question", "part2_topics": "topic", "part3_discussions": "discussion"}.get(table_name)
-    if not column: return []
-    return execute_db_query(f"SELECT id, {column} FROM {table_name} ORDER BY id", fetch="all") or []
+def get_questions_page(table_name, page):
+    query = QUERIES.get(("get_page", table_name))
+    if not query: return []
+    offset = (page - 1) * QUESTIONS_PER_PAGE
+    return execute_db_query(query, (QUESTIONS_PER_PAGE, offset), fetch="all") or []
 
 def get_item_count(table_name):
-    result = execute_db_query(f"SELECT COUNT(id) FROM {table_name}", fetch="one")
-    return result[0] if result else -1
+    with _ITEM_COUNT_LOCK:
+        count = _ITEM_COUNT_CACHE.get(table_name)
+        generation = _ITEM_COUNT_GENERATION[table_name]
+    if count is None:
+        query = QUERIES.get(("count", table_name))
+        if not query: return -1
+        result = execute_db_query(query, fetch="one")
+        if not result: return -1
+        count = result[0]
+        with _ITEM_COUNT_LOCK:
+            if _ITEM_COUNT_GENERATION[table_name] == generation:
+                _ITEM_COUNT_CACHE[table_name] = count
+    return count
 
 # --- User Analytics ---
 def add_or_update_user_activity(chat_id):
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user = execute_db_query("SELECT id FROM users WHERE chat_id = ?", (chat_id,), fetch="one")
-    if user:
-        execute_db_query("UPDATE users SET last_interaction = ? WHERE chat_id = ?", (now, chat_id))
-    else:
-        execute_db_query("INSERT INTO users (chat_id, first_seen, last_interaction) VALUES (?, ?, ?)", (chat_id, now, now))
-        logging.info(f"Added new unique user: {chat_id}")
+    execute_db_query(
+        "INSERT INTO users (chat_id, first_seen, last_interaction) VALUES (?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP) "
+        "ON CONFLICT(chat_id) DO UPDATE SET last_interaction = excluded.last_interaction",
+        (chat_id,))
 
 def get_user_counts(days=None):
     query = "SELECT COUNT(DISTINCT chat_id) FROM users"
@@ -167,12 +359,55 @@ def get_all_user_chat_ids():
     results = execute_db_query("SELECT chat_id FROM users", fetch="all")
     return [r[0] for r in results] if results else []
 
+# --- OpenAI Result Caches ---
+# Thread-safe LRU with a per-entry TTL, shared by the AI feedback workers.
+class _LRUCache:
+    def __init__(self, maxsize, ttl):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self._ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+_TRANSCRIPT_CACHE = _LRUCache(AI_CACHE_SIZE, AI_CACHE_TTL_SECONDS)
+_FEEDBACK_CACHE = _LRUCache(AI_CACHE_SIZE, AI_CACHE_TTL_SECONDS)
+
+def _hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 # --- OpenAI Helper Function ---
 def get_ielts_feedback(question, transcript):
     if not openai_client:
         return "OpenAI client is not configured. Cannot provide feedback."
 
-    prompt = f\"\"\"You are a friendly and encouraging IELTS speaking coach. Provide concise feedback.\"\"\"
+    cache_key = hashlib.blake2b(f"{question}||{transcript}".encode(), digest_size=16).hexdigest()
+    cached_feedback = _FEEDBACK_CACHE.get(cache_key)
+    if cached_feedback is not None:
+        return cached_feedback
+
+    prompt = """You are a friendly and encouraging IELTS speaking coach. Provide concise feedback."""
     try:
         response = openai_client.chat.completions.create(
             model="gpt-4o-mini",
@@ -182,46 +417,143 @@ def get_ielts_feedback(question, transcript):
             ],
             temperature=0.7,
         )
-        return response.choices[0].message.content
+        feedback = response.choices[0].message.content
+        _FEEDBACK_CACHE.put(cache_key, feedback)
+        return feedback
     except RateLimitError:
-        logging.error("OpenAI RateLimitError encountered.")
+        logger.error("OpenAI RateLimitError encountered.")
         return "I'm experiencing high demand right now. Please try again in a moment."
     except APIError as e:
-        logging.error(f"OpenAI APIError encountered: {e}")
+        logger.error("OpenAI APIError encountered: %s", e)
         return "I'm having trouble connecting to my analysis tools. Please try again later."
     except Exception as e:
-        logging.error(f"Unexpected error while getting feedback from OpenAI: {e}")
+        logger.error("Unexpected error while getting feedback from OpenAI: %s", e)
         return "Sorry, I encountered an unexpected error while analyzing your answer. Please try again."
 
+# Streams the file to disk so it is never held in memory as a whole.
+def download_telegram_file(file_id, suffix="", prefix=None, directory=None):
+    response = _HTTP_SESSION.get(bot.get_file_url(file_id), stream=True, timeout=(10, 60))
+    with response:
+        # raise_for_status() would put the file URL, and with it the bot token, into the error message.
+        if response.status_code != 200:
+            raise telebot.apihelper.ApiHTTPException("Download file", response)
+        # Let urllib3 undo any Content-Encoding so the file on disk holds the raw audio.
+        response.raw.decode_content = True
+        with tempfile.NamedTemporaryFile(suffix=suffix, prefix=prefix, dir=directory, delete=False) as temp_file:
+            try:
+                shutil.copyfileobj(response.raw, temp_file)
+            except Exception:
+                temp_file.close()
+                os.remove(temp_file.name)
+                raise
+    return temp_file.name
+
+# --- AI Feedback Workers ---
+# Voice answers are queued by the handler and processed here, so slow OpenAI
+# calls never hold up Telegram update handling.
+_FEEDBACK_JOBS = queue.Queue(maxsize=AI_QUEUE_SIZE)
+# Queued jobs die with the process, so their voice files are tagged for cleanup on the next start.
+VOICE_TMP_PREFIX = "speakify-voice-"
+_AI_BUSY_MESSAGE = "⏳ The AI Examiner is busy right now. Please send your voice answer again in a minute."
+
+def process_voice_feedback(chat_id, question, audio_path):
+    try:
+        audio_key = _hash_file(audio_path)
+        transcript = _TRANSCRIPT_CACHE.get(audio_key)
+        if transcript is None:
+            bot.send_chat_action(chat_id, 'upload_voice')
+            with open(audio_path, "rb") as audio_file_for_api:
+                transcript_response = openai_client.audio.transcriptions.create(model="whisper-1", file=audio_file_for_api)
+            transcript = transcript_response.text
+            _TRANSCRIPT_CACHE.put(audio_key, transcript)
+
+        bot.send_chat_action(chat_id, 'typing')
+        feedback = get_ielts_feedback(question, transcript)
+        bot.send_message(chat_id, feedback, parse_mode='Markdown')
+    except Exception as e:
+        logger.error("Error during AI check process: %s", e)
+        bot.send_message(chat_id, "❌ Sorry, I couldn't process that. Please make sure the audio is clear and try again.")
+    finally:
+        os.remove(audio_path)
+
+def _feedback_worker():
+    while True:
+        job_id, chat_id, question, audio_path = _FEEDBACK_JOBS.get()
+        try:
+            process_voice_feedback(chat_id, question, audio_path)
+        except Exception as e:
+            logger.error("AI feedback job %s for chat %s failed: %s", job_id, chat_id, e)
+        finally:
+            _FEEDBACK_JOBS.task_done()
+
+def _remove_orphaned_voice_files():
+    for path in Path(VOICE_TMP_DIR or tempfile.gettempdir()).glob(f"{VOICE_TMP_PREFIX}*"):
+        try:
+            path.unlink()
+        except OSError as e:
+            logger.warning("Could not remove orphaned voice file %s: %s", path, e)
+
+def start_feedback_workers():
+    _remove_orphaned_voice_files()
+    for i in range(AI_WORKER_COUNT):
+        threading.Thread(target=_feedback_worker, name=f"ai-feedback-{i}", daemon=True).start()
+
 # --- UI & Pagination Helpers ---
-def create_pagination_keyboard(page, total_pages, context):
+# Constant keyboards are built once at import time and shared by all handlers.
+def _build_reply_markup(rows, **kwargs):
+    markup = ReplyKeyboardMarkup(resize_keyboard=True, **kwargs)
+    for row in rows:
+        markup.add(*(KeyboardButton(text) for text in row))
+    return markup
+
+_MAIN_MENU_MARKUP = _build_reply_markup([
+    ("1️⃣ Part 1", "2️⃣ Part 2", "3️⃣ Part 3"),
+    ("📜 List All Questions", "💬 Chat with Admin"),
+])
+_ADMIN_MENU_MARKUP = _build_reply_markup([
+    ("➕ Add Question", "➖ Delete Question"),
+    ("📄 List Questions", "📊 User Statistics"),
+    ("📢 Broadcast",),
+    ("⬅️ Back to Main",),
+])
+_CANCEL_MARKUP = _build_reply_markup([("❌ Cancel",)], one_time_keyboard=True)
+
+@functools.lru_cache(maxsize=8)
+def _part_selection_markup(back_button_text):
+    return _build_reply_markup([("Part 1", "Part 2", "Part 3"), (back_button_text,)], one_time_keyboard=True)
+
+@functools.lru_cache(maxsize=8)
+def _question_keyboard(table_name):
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("Get Another Question", callback_data=f"random_{table_name}"), InlineKeyboardButton("🤖 AI Check", callback_data=f"aicheck_{table_name}"))
+    return keyboard
+
+# Callback data is "p<page><table index>", e.g. "p40" for page 4 of part1_questions.
+def create_pagination_keyboard(page, total_pages, table_index):
     keyboard = InlineKeyboardMarkup()
     row = []
     if page > 1:
-        row.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"page_{page-1}_{context}"))
+        row.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"p{page-1}{table_index}"))
     if page < total_pages:
-        row.append(InlineKeyboardButton("Next ➡️", callback_data=f"page_{page+1}_{context}"))
+        row.append(InlineKeyboardButton("Next ➡️", callback_data=f"p{page+1}{table_index}"))
     keyboard.add(*row)
     return keyboard
 
 def send_paginated_list(chat_id, table_name, part_name, page=1, message_id=None):
-    questions = get_all_questions(table_name)
-    if not questions:
+    total_questions = get_item_count(table_name)
+    if total_questions <= 0:
         bot.send_message(chat_id, f"No {part_name} found.")
         return
 
-    total_pages = math.ceil(len(questions) / QUESTIONS_PER_PAGE)
+    total_pages = math.ceil(total_questions / QUESTIONS_PER_PAGE)
     page = max(1, min(page, total_pages))
-    start_index = (page - 1) * QUESTIONS_PER_PAGE
-    end_index = start_index + QUESTIONS_PER_PAGE
-    page_questions = questions[start_index:end_index]
+    page_questions = get_questions_page(table_name, page)
 
     header = f"📋 **{part_name}** (Page {page}/{total_pages}):\n\n"
     lines = [f"**ID: {q[0]}** - {q[1]}" for q in page_questions]
     text = header + "\n\n".join(lines)
 
-    context = f"{table_name}"
-    keyboard = create_pagination_keyboard(page, total_pages, context)
+    keyboard = create_pagination_keyboard(page, total_pages, _TABLE_INDEX[table_name])
 
     try:
         if message_id:
@@ -230,53 +562,81 @@ def send_paginated_list(chat_id, table_name, part_name, page=1, message_id=None)
             bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='Markdown')
     except telebot.apihelper.ApiTelegramException as e:
         if "message is not modified" not in e.description:
-            logging.error(f"Error sending/editing paginated list: {e}")
+            logger.error("Error sending/editing paginated list: %s", e)
 
 def send_part_selection_menu(chat_id, text, back_button_text):
-    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    markup.add(KeyboardButton("Part 1"), KeyboardButton("Part 2"), KeyboardButton("Part 3"))
-    markup.add(KeyboardButton(back_button_text))
-    bot.send_message(chat_id, text, reply_markup=markup)
+    bot.send_message(chat_id, text, reply_markup=_part_selection_markup(back_button_text))
 
 def send_admin_menu(chat_id):
-    ADMIN_STATES[chat_id] = AdminState.IN_ADMIN_PANEL
-    USER_STATES.pop(chat_id, None)
-    markup = ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(KeyboardButton("➕ Add Question"), KeyboardButton("➖ Delete Question"))
-    markup.add(KeyboardButton("📄 List Questions"), KeyboardButton("📊 User Statistics"))
-    markup.add(KeyboardButton("📢 Broadcast"))
-    markup.add(KeyboardButton("⬅️ Back to Main"))
-    bot.send_message(chat_id, "Welcome to the Admin Panel!", reply_markup=markup)
+    session = SESSIONS[chat_id]
+    session.admin_state = AdminState.IN_ADMIN_PANEL
+    session.user_state = None
+    bot.send_message(chat_id, "Welcome to the Admin Panel!", reply_markup=_ADMIN_MENU_MARKUP)
+
+# --- Broadcast Helpers ---
+class _RateLimiter:
+    """Thread-safe limiter that spaces calls to at most `rate` per second."""
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+def _copy_broadcast_message(chat_id, from_chat_id, message_id, limiter):
+    for attempt in range(2):
+        limiter.wait()
+        try:
+            bot.copy_message(chat_id, from_chat_id, message_id)
+            return True
+        except telebot.apihelper.ApiTelegramException as e:
+            retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after") if e.error_code == 429 else None
+            if retry_after is None or attempt:
+                logger.warning("Failed to send broadcast to %s: %s", chat_id, e)
+                return False
+            # Flood control applies to the whole bot, so every broadcast worker backs off.
+            limiter.pause(retry_after)
+        except requests.exceptions.RequestException as e:
+            # Logged by type only: requests messages embed the token-bearing URL.
+            logger.warning("Failed to send broadcast to %s: %s", chat_id, type(e).__name__)
+            return False
+    return False
 
 # --- Handlers ---
 @bot.message_handler(commands=['start'])
 def start_command(message):
     add_or_update_user_activity(message.chat.id)
-    ADMIN_STATES.pop(message.chat.id, None)
-    USER_STATES[message.chat.id] = UserState.MAIN_MENU
-    markup = ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(KeyboardButton("1️⃣ Part 1"), KeyboardButton("2️⃣ Part 2"), KeyboardButton("3️⃣ Part 3"))
-    markup.add(KeyboardButton("📜 List All Questions"), KeyboardButton("💬 Chat with Admin"))
-    bot.send_message(message.chat.id, "Welcome to the **SPEAKIFY BOT**! 🤖\n\nSelect a part to get a random practice question.", reply_markup=markup, parse_mode='Markdown')
+    session = SESSIONS[message.chat.id]
+    session.admin_state = None
+    session.user_state = UserState.MAIN_MENU
+    bot.send_message(message.chat.id, "Welcome to the **SPEAKIFY BOT**! 🤖\n\nSelect a part to get a random practice question.", reply_markup=_MAIN_MENU_MARKUP, parse_mode='Markdown')
 
 @bot.message_handler(commands=['admin'])
 def admin_command(message):
     if message.from_user.id not in ADMIN_IDS:
         bot.send_message(message.chat.id, "⛔ Unauthorized.")
         return
-    logging.info(f"Admin {message.from_user.id} entered admin panel.")
+    logger.info("Admin %s entered admin panel.", message.from_user.id)
     send_admin_menu(message.chat.id)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('page_'))
+@bot.callback_query_handler(func=lambda call: _PAGE_CALLBACK_RE.fullmatch(call.data))
 def pagination_handler(call):
     try:
-        _, page_str, table_name = call.data.split('_', 2)
-        page = int(page_str)
-        part_map = {"part1_questions": "Part 1 Questions", "part2_topics": "Part 2 Topics", "part3_discussions": "Part 3 Discussions"}
-        part_name = part_map.get(table_name, "Questions")
+        page_str, table_index = _PAGE_CALLBACK_RE.fullmatch(call.data).groups()
+        page, table_name = int(page_str), TABLES[int(table_index)]
+        part_name = _LIST_TITLE_BY_TABLE.get(table_name, "Questions")
         send_paginated_list(call.message.chat.id, table_name, part_name, page, call.message.message_id)
-    except (ValueError, IndexError) as e:
-        logging.error(f"Invalid callback data format: {call.data}, error: {e}")
     finally:
         bot.answer_callback_query(call.id)
 
@@ -288,42 +648,37 @@ def handle_question_buttons(call):
 
     if data[0] == 'random':
         table_name = data[1]
-        part_number = {"part1_questions": "1", "part2_topics": "2", "part3_discussions": "3"}.get(table_name, "")
+        part_number = _PART_NUMBER_BY_TABLE.get(table_name, "")
         question = get_random_question(table_name)
-        USER_CURRENT_QUESTION[chat_id] = question
-
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("Get Another Question", callback_data=f"random_{table_name}"), InlineKeyboardButton("🤖 AI Check", callback_data=f"aicheck_{table_name}"))
+        SESSIONS[chat_id].current_question = question
 
         bot.edit_message_text(f"💬 **Part {part_number} Question:**\n\n{question}",
                               chat_id,
                               message_id,
-                              reply_markup=keyboard,
+                              reply_markup=_question_keyboard(table_name),
                               parse_mode='Markdown')
 
     elif data[0] == 'aicheck':
-        USER_STATES[chat_id] = UserState.AWAITING_VOICE_ANSWER
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        markup.add(KeyboardButton("❌ Cancel"))
-        bot.send_message(chat_id, f"🎤 **AI Examiner is ready!**\n\nPlease send me a **voice message** with your answer (max {int(MAX_VOICE_DURATION_SECONDS / 60)} minutes).\n\nI will analyze it and give you direct feedback and a model answer. Press '❌ Cancel' to return to the main menu.", reply_markup=markup, parse_mode='Markdown')
+        SESSIONS[chat_id].user_state = UserState.AWAITING_VOICE_ANSWER
+        bot.send_message(chat_id, f"🎤 **AI Examiner is ready!**\n\nPlease send me a **voice message** with your answer (max {int(MAX_VOICE_DURATION_SECONDS / 60)} minutes).\n\nI will analyze it and give you direct feedback and a model answer. Press '❌ Cancel' to return to the main menu.", reply_markup=_CANCEL_MARKUP, parse_mode='Markdown')
 
     bot.answer_callback_query(call.id)
 
-@bot.message_handler(func=lambda msg: msg.from_user.id in ADMIN_IDS and re.match(r'^\d+:\d+$', msg.text.strip()))
+# Membership test first so messages from non-admins never reach the regex.
+@bot.message_handler(func=lambda msg: msg.from_user.id in ADMIN_IDS and msg.text and _ADMIN_ID_RE.match(msg.text.strip()))
 def handle_admin_get_question_by_id(message):
     chat_id = message.chat.id
     try:
         part_str, q_id_str = message.text.strip().split(':', 1)
         part, q_id = int(part_str), int(q_id_str)
 
-        part_map = {1: "part1_questions", 2: "part2_topics", 3: "part3_discussions"}
-        table_name = part_map.get(part)
+        table_name = _TABLE_BY_PART.get(part)
         if not table_name:
             bot.send_message(chat_id, f"Invalid part number: {part}. Please use 1, 2, or 3.")
             return
 
         question = get_question_by_id(table_name, q_id)
-        part_name = {1: "Part 1 Question", 2: "Part 2 Topic", 3: "Part 3 Discussion"}.get(part)
+        part_name = _PART_NAME_BY_PART.get(part)
 
         if "No item found" in question:
             bot.send_message(chat_id, f"⚠️ {question}")
@@ -333,25 +688,20 @@ def handle_admin_get_question_by_id(message):
     except (ValueError, IndexError):
         bot.send_message(chat_id, "Invalid format. Please use `part:id` (e.g., `1:15`).")
     except Exception as e:
-        logging.error(f"Error in handle_admin_get_question_by_id: {e}")
+        logger.error("Error in handle_admin_get_question_by_id: %s", e)
         bot.send_message(chat_id, "An unexpected error occurred.")
 
-@bot.message_handler(func=lambda msg: ADMIN_STATES.get(msg.from_user.id) == AdminState.IN_ADMIN_PANEL)
+@bot.message_handler(func=lambda msg: _admin_state(msg.from_user.id) == AdminState.IN_ADMIN_PANEL)
 def handle_admin_menu(message):
     user_id = message.from_user.id
     text = message.text.strip()
-    action_map = {
-        "➕ Add Question": AdminState.SELECT_ADD_CATEGORY,
-        "➖ Delete Question": AdminState.SELECT_DELETE_CATEGORY,
-        "📄 List Questions": AdminState.SELECT_LIST_CATEGORY,
-    }
-    if text in action_map:
-        ADMIN_STATES[user_id] = action_map[text]
+    if text in _ADMIN_ACTION_BY_BUTTON:
+        SESSIONS[user_id].admin_state = _ADMIN_ACTION_BY_BUTTON[text]
         send_part_selection_menu(user_id, f"Which part to {text.split(' ')[1].lower()}?", "⬅️ Admin Menu")
     elif text == "📊 User Statistics":
         show_user_stats(message)
     elif text == "📢 Broadcast":
-        ADMIN_STATES[user_id] = AdminState.AWAITING_BROADCAST_MESSAGE
+        SESSIONS[user_id].admin_state = AdminState.AWAITING_BROADCAST_MESSAGE
         bot.send_message(user_id, "Send the message you want to broadcast (text, photo, etc.).", reply_markup=ForceReply())
     elif text == "⬅️ Back to Main":
         start_command(message)
@@ -371,17 +721,16 @@ def show_user_stats(message):
     bot.send_message(message.chat.id, stats, parse_mode='Markdown')
     send_admin_menu(message.chat.id)
 
-@bot.message_handler(func=lambda msg: ADMIN_STATES.get(msg.from_user.id) in [
+@bot.message_handler(func=lambda msg: _admin_state(msg.from_user.id) in [
     AdminState.SELECT_ADD_CATEGORY, AdminState.SELECT_DELETE_CATEGORY, AdminState.SELECT_LIST_CATEGORY
 ])
 def handle_admin_category_selection(message):
-    user_id, state, part = message.from_user.id, ADMIN_STATES.get(message.from_user.id), message.text.strip()
+    user_id, state, part = message.from_user.id, _admin_state(message.from_user.id), message.text.strip()
     if part == "⬅️ Admin Menu":
         send_admin_menu(user_id)
         return
 
-    part_map = {"Part 1": "part1_questions", "Part 2": "part2_topics", "Part 3": "part3_discussions"}
-    table_name = part_map.get(part)
+    table_name = _TABLE_BY_PART_BUTTON.get(part)
     if not table_name:
         bot.send_message(user_id, "Invalid part.")
         return
@@ -390,27 +739,20 @@ def handle_admin_category_selection(message):
         send_paginated_list(user_id, table_name, f"{part} Questions")
         send_admin_menu(user_id)
     elif state == AdminState.SELECT_ADD_CATEGORY:
-        state_map = {"Part 1": AdminState.AWAITING_ADD_PART1, "Part 2": AdminState.AWAITING_ADD_PART2, "Part 3": AdminState.AWAITING_ADD_PART3}
-        ADMIN_STATES[user_id] = state_map[part]
+        SESSIONS[user_id].admin_state = _ADD_STATE_BY_PART_BUTTON[part]
         bot.send_message(user_id, f"Send the new text for **{part}**.", reply_markup=ForceReply(), parse_mode='Markdown')
     elif state == AdminState.SELECT_DELETE_CATEGORY:
-        state_map = {"Part 1": AdminState.AWAITING_DELETE_ID_PART1, "Part 2": AdminState.AWAITING_DELETE_ID_PART2, "Part 3": AdminState.AWAITING_DELETE_ID_PART3}
-        ADMIN_STATES[user_id] = state_map[part]
+        SESSIONS[user_id].admin_state = _DELETE_STATE_BY_PART_BUTTON[part]
         send_paginated_list(user_id, table_name, f"{part} Questions")
         bot.send_message(user_id, f"Send the **ID** of the item to delete from **{part}**.", reply_markup=ForceReply(), parse_mode='Markdown')
 
 @bot.message_handler(func=lambda msg:
-                     ADMIN_STATES.get(msg.from_user.id) is not None and
-                     "AWAITING" in ADMIN_STATES.get(msg.from_user.id).name and
-                     ADMIN_STATES.get(msg.from_user.id) != AdminState.AWAITING_BROADCAST_MESSAGE)
+                     (state := _admin_state(msg.from_user.id)) is not None and
+                     "AWAITING" in state.name and
+                     state != AdminState.AWAITING_BROADCAST_MESSAGE)
 def handle_admin_input(message):
-    user_id, state, text = message.from_user.id, ADMIN_STATES.get(message.from_user.id), message.text.strip()
-    table_map = {
-        AdminState.AWAITING_ADD_PART1: "part1_questions", AdminState.AWAITING_DELETE_ID_PART1: "part1_questions",
-        AdminState.AWAITING_ADD_PART2: "part2_topics", AdminState.AWAITING_DELETE_ID_PART2: "part2_topics",
-        AdminState.AWAITING_ADD_PART3: "part3_discussions", AdminState.AWAITING_DELETE_ID_PART3: "part3_discussions"
-    }
-    table_name = table_map.get(state)
+    user_id, state, text = message.from_user.id, _admin_state(message.from_user.id), message.text.strip()
+    table_name = _TABLE_BY_ADMIN_STATE.get(state)
 
     if "AWAITING_ADD" in state.name:
         _, msg = add_question_to_db(table_name, text)
@@ -424,30 +766,27 @@ def handle_admin_input(message):
             return
     send_admin_menu(user_id)
 
-@bot.message_handler(content_types=['text', 'photo', 'video', 'document', 'audio', 'voice', 'sticker'], func=lambda msg: ADMIN_STATES.get(msg.from_user.id) == AdminState.AWAITING_BROADCAST_MESSAGE)
+@bot.message_handler(content_types=['text', 'photo', 'video', 'document', 'audio', 'voice', 'sticker'], func=lambda msg: _admin_state(msg.from_user.id) == AdminState.AWAITING_BROADCAST_MESSAGE)
 def handle_broadcast_message(message):
     user_id = message.from_user.id
-    logging.info(f"Admin {user_id} initiated a broadcast.")
+    logger.info("Admin %s initiated a broadcast.", user_id)
     bot.send_message(user_id, "Broadcasting your message to all users... This may take a moment.")
 
-    all_chat_ids = get_all_user_chat_ids()
-    success_count, fail_count = 0, 0
+    recipients = [chat_id for chat_id in get_all_user_chat_ids() if chat_id != user_id]
+    limiter = _RateLimiter(BROADCAST_RATE_PER_SECOND)
+    success_count = 0
 
-    for chat_id in all_chat_ids:
-        if chat_id == user_id: continue
-        try:
-            bot.copy_message(chat_id, message.chat.id, message.message_id)
-            success_count += 1
-            time.sleep(BROADCAST_DELAY_SECONDS)
-        except telebot.apihelper.ApiTelegramException as e:
-            logging.warning(f"Failed to send broadcast to {chat_id}: {e}")
-            fail_count += 1
+    with ThreadPoolExecutor(max_workers=BROADCAST_CONCURRENCY) as executor:
+        for start in range(0, len(recipients), BROADCAST_CHUNK_SIZE):
+            chunk = recipients[start:start + BROADCAST_CHUNK_SIZE]
+            success_count += sum(executor.map(lambda chat_id: _copy_broadcast_message(chat_id, message.chat.id, message.message_id, limiter), chunk))
+    fail_count = len(recipients) - success_count
 
     summary_message = f"📢 **Broadcast Complete**\n\n✅ Sent successfully to: **{success_count}** users.\n❌ Failed for: **{fail_count}** users."
     bot.send_message(user_id, summary_message, parse_mode='Markdown')
     send_admin_menu(user_id)
 
-@bot.message_handler(content_types=['text', 'photo', 'video', 'document', 'audio', 'voice', 'sticker'], func=lambda msg: USER_STATES.get(msg.from_user.id) == UserState.AWAITING_ADMIN_MESSAGE)
+@bot.message_handler(content_types=['text', 'photo', 'video', 'document', 'audio', 'voice', 'sticker'], func=lambda msg: _user_state(msg.from_user.id) == UserState.AWAITING_ADMIN_MESSAGE)
 def handle_admin_chat_message(message):
     user_id = message.from_user.id
     user_full_name = message.from_user.first_name + (f" {message.from_user.last_name}" if message.from_user.last_name else "")
@@ -459,12 +798,12 @@ def handle_admin_chat_message(message):
             bot.send_message(admin_id, admin_message_header, parse_mode='Markdown')
             bot.copy_message(admin_id, user_id, message.message_id)
         except telebot.apihelper.ApiTelegramException as e:
-            logging.warning(f"Failed to forward user message to admin {admin_id}: {e}")
+            logger.warning("Failed to forward user message to admin %s: %s", admin_id, e)
 
     bot.send_message(user_id, "✅ Your message has been sent to the admin team!", reply_markup=ReplyKeyboardRemove())
     start_command(message)
 
-@bot.message_handler(content_types=['voice'], func=lambda msg: USER_STATES.get(msg.from_user.id) == UserState.AWAITING_VOICE_ANSWER and openai_client)
+@bot.message_handler(content_types=['voice'], func=lambda msg: _user_state(msg.from_user.id) == UserState.AWAITING_VOICE_ANSWER and openai_client)
 def handle_voice_message_for_feedback(message):
     chat_id = message.chat.id
 
@@ -472,115 +811,145 @@ def handle_voice_message_for_feedback(message):
         bot.send_message(chat_id, f"⚠️ Your voice message is too long ({message.voice.duration}s). Please keep it under {MAX_VOICE_DURATION_SECONDS} seconds.")
         return
 
+    # Check before downloading so a full backlog costs no tmpfs space; the user stays in voice-answer mode.
+    if _FEEDBACK_JOBS.full():
+        bot.send_message(chat_id, _AI_BUSY_MESSAGE)
+        return
+
+    audio_path = None
     try:
         bot.send_chat_action(chat_id, 'typing')
+        audio_path = download_telegram_file(message.voice.file_id, suffix=".ogg", prefix=VOICE_TMP_PREFIX, directory=VOICE_TMP_DIR)
+        question = SESSIONS[chat_id].current_question or "an IELTS question"
+        _FEEDBACK_JOBS.put_nowait((message.message_id, chat_id, question, audio_path))
+        audio_path = None  # the worker now owns the file and removes it when done
         bot.send_message(chat_id, "🎧 Got it! Analyzing your response now... this might take a moment.")
 
-        file_info = bot.get_file(message.voice.file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
-
-        audio_path = f"user_audio_{chat_id}.ogg"
-        with open(audio_path, "wb") as audio_file:
-            audio_file.write(downloaded_file)
-
-        bot.send_chat_action(chat_id, 'upload_voice')
-        with open(audio_path, "rb") as audio_file_for_api:
-            transcript_response = openai_client.audio.transcriptions.create(model="whisper-1", file=audio_file_for_api)
-        os.remove(audio_path)
-        transcript = transcript_response.text
+    except queue.Full:
+        bot.send_message(chat_id, _AI_BUSY_MESSAGE)
+        return
 
-        question = USER_CURRENT_QUESTION.get(chat_id, "an IELTS question")
-        bot.send_chat_action(chat_id, 'typing')
-        feedback = get_ielts_feedback(question, transcript)
-        bot.send_message(chat_id, feedback, parse_mode='Markdown')
+    except requests.exceptions.RequestException as e:
+        # requests puts the file URL, which embeds the bot token, into its messages; log only the type.
+        logger.error("Voice download failed: %s", type(e).__name__)
+        bot.send_message(chat_id, "❌ Sorry, I couldn't process that. Please make sure the audio is clear and try again.")
 
     except Exception as e:
-        logging.error(f"Error during AI check process: {e}")
+        logger.error("Error during AI check process: %s", e)
         bot.send_message(chat_id, "❌ Sorry, I couldn't process that. Please make sure the audio is clear and try again.")
 
     finally:
-        USER_STATES.pop(chat_id, None)
-        USER_CURRENT_QUESTION.pop(chat_id, None)
-        start_command(message)
+        if audio_path:
+            os.remove(audio_path)
+
+    session = SESSIONS[chat_id]
+    session.user_state = session.current_question = None
+    start_command(message)
+
+# --- User Menu Dispatch ---
+def _serve_random_question(message, table_name):
+    chat_id = message.chat.id
+    question = get_random_question(table_name)
+    SESSIONS[chat_id].current_question = question
+    bot.send_message(chat_id, f"💬 **Part {_PART_NUMBER_BY_TABLE[table_name]} Question:**\n\n{question}", reply_markup=_question_keyboard(table_name), parse_mode='Markdown')
+
+def _enter_listing_menu(message):
+    SESSIONS[message.chat.id].user_state = UserState.LISTING_MENU
+    send_part_selection_menu(message.chat.id, "Which part's questions would you like to see?", "⬅️ Main Menu")
+
+def _enter_admin_chat(message):
+    SESSIONS[message.chat.id].user_state = UserState.AWAITING_ADMIN_MESSAGE
+    bot.send_message(message.chat.id, "📝 Send me your message for the admin team. I will forward it. Or, press '❌ Cancel' to go back.", reply_markup=_CANCEL_MARKUP)
+
+def _send_main_menu_hint(message):
+    bot.send_message(message.chat.id, "Sorry, I didn't understand that. Please use the buttons on the keyboard or type /start to begin.")
+
+def _list_part(message, part):
+    send_paginated_list(message.chat.id, _TABLE_BY_PART_BUTTON[part], f"{part} Questions")
+    bot.send_message(message.chat.id, "Use the buttons above to navigate the list. You can select another part from the menu below.")
+
+def _send_invalid_part(message):
+    bot.send_message(message.chat.id, "Please choose a valid part from the menu.")
+
+def _cancel_admin_chat(message):
+    bot.send_message(message.chat.id, "❌ Chat with admin cancelled.", reply_markup=ReplyKeyboardRemove())
+    start_command(message)
+
+def _cancel_voice_answer(message):
+    session = SESSIONS[message.chat.id]
+    session.user_state = session.current_question = None
+    bot.send_message(message.chat.id, "❌ AI Check cancelled.", reply_markup=ReplyKeyboardRemove())
+    start_command(message)
+
+def _prompt_for_voice_answer(message):
+    bot.send_message(message.chat.id, "Please send a **voice message** or press '❌ Cancel' to go back.", parse_mode='Markdown')
+
+# Exact (state, button text) matches first, then a per-state fallback; users with no state get /start.
+_DISPATCH = {
+    **{(UserState.MAIN_MENU, button): functools.partial(_serve_random_question, table_name=table_name) for button, table_name in _TABLE_BY_MENU_BUTTON.items()},
+    (UserState.MAIN_MENU, "📜 List All Questions"): _enter_listing_menu,
+    (UserState.MAIN_MENU, "💬 Chat with Admin"): _enter_admin_chat,
+    (UserState.LISTING_MENU, "⬅️ Main Menu"): start_command,
+    **{(UserState.LISTING_MENU, part): functools.partial(_list_part, part=part) for part in _TABLE_BY_PART_BUTTON},
+    (UserState.AWAITING_ADMIN_MESSAGE, "❌ Cancel"): _cancel_admin_chat,
+    (UserState.AWAITING_VOICE_ANSWER, "❌ Cancel"): _cancel_voice_answer,
+}
+_FALLBACK_BY_STATE = {
+    UserState.MAIN_MENU: _send_main_menu_hint,
+    UserState.LISTING_MENU: _send_invalid_part,
+    UserState.AWAITING_ADMIN_MESSAGE: handle_admin_chat_message,
+    UserState.AWAITING_VOICE_ANSWER: _prompt_for_voice_answer,
+}
 
 @bot.message_handler(func=lambda message: True)
 def handle_user_message(message):
     chat_id = message.chat.id
-    user_state = USER_STATES.get(chat_id)
+    user_state = _user_state(chat_id)
     text = message.text.strip() if message.text else ""
 
-    if chat_id in ADMIN_IDS and ADMIN_STATES.get(chat_id):
-        if ADMIN_STATES.get(chat_id) == AdminState.IN_ADMIN_PANEL:
+    admin_state = _admin_state(chat_id)
+    if chat_id in ADMIN_IDS and admin_state:
+        if admin_state == AdminState.IN_ADMIN_PANEL:
              bot.send_message(chat_id, "Invalid option. Please use the menu or send a request like `1:25`.")
         return
 
     add_or_update_user_activity(chat_id)
 
-    if user_state == UserState.MAIN_MENU:
-        action_map = {"1️⃣ Part 1": "part1_questions", "2️⃣ Part 2": "part2_topics", "3️⃣ Part 3": "part3_discussions"}
-        if text in action_map:
-            table_name = action_map[text]
-            question = get_random_question(table_name)
-            USER_CURRENT_QUESTION[chat_id] = question
-            part_number = text.split(' ')[1].replace('️⃣', '')
-
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("Get Another Question", callback_data=f"random_{table_name}"), InlineKeyboardButton("🤖 AI Check", callback_data=f"aicheck_{table_name}"))
-
-            bot.send_message(chat_id, f"💬 **Part {part_number} Question:**\n\n{question}", reply_markup=keyboard, parse_mode='Markdown')
-        elif text == "📜 List All Questions":
-            USER_STATES[chat_id] = UserState.LISTING_MENU
-            send_part_selection_menu(chat_id, "Which part's questions would you like to see?", "⬅️ Main Menu")
-        elif text == "💬 Chat with Admin":
-            USER_STATES[chat_id] = UserState.AWAITING_ADMIN_MESSAGE
-            markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-            markup.add(KeyboardButton("❌ Cancel"))
-            bot.send_message(chat_id, "📝 Send me your message for the admin team. I will forward it. Or, press '❌ Cancel' to go back.", reply_markup=markup)
-        else:
-            bot.send_message(chat_id, "Sorry, I didn't understand that. Please use the buttons on the keyboard or type /start to begin.")
+    handler = _DISPATCH.get((user_state, text)) or _FALLBACK_BY_STATE.get(user_state, start_command)
+    handler(message)
 
-    elif user_state == UserState.LISTING_MENU:
-        if text == "⬅️ Main Menu":
-            start_command(message)
-            return
-        part_map = {"Part 1": "part1_questions", "Part 2": "part2_topics", "Part 3": "part3_discussions"}
-        table_name = part_map.get(text)
-        if table_name:
-            send_paginated_list(chat_id, table_name, f"{text} Questions")
-            bot.send_message(chat_id, f"Use the buttons above to navigate the list. You can select another part from the menu below.")
-        else:
-            bot.send_message(chat_id, "Please choose a valid part from the menu.")
+# --- Polling Supervisor ---
+# With non_stop=True telebot retries Telegram API errors itself (429s after _HandlerExceptionHandler
+# has slept for retry_after), and handler exceptions are swallowed there too, so only getUpdates
+# network errors get here.
+POLLING_MAX_BACKOFF_SECONDS = 300
+POLLING_TIMEOUT_RETRY_SECONDS = 3
+# A polling session that survives this long counts as healthy and resets the backoff.
+POLLING_HEALTHY_SECONDS = 60
 
-    elif user_state == UserState.AWAITING_ADMIN_MESSAGE:
-        if text == "❌ Cancel":
-            bot.send_message(chat_id, "❌ Chat with admin cancelled.", reply_markup=ReplyKeyboardRemove())
-            start_command(message)
-        else:
-            handle_admin_chat_message(message)
-
-    elif user_state == UserState.AWAITING_VOICE_ANSWER:
-        if text == "❌ Cancel":
-            USER_STATES.pop(chat_id, None)
-            USER_CURRENT_QUESTION.pop(chat_id, None)
-            bot.send_message(chat_id, "❌ AI Check cancelled.", reply_markup=ReplyKeyboardRemove())
-            start_command(message)
-        else:
-            bot.send_message(chat_id, "Please send a **voice message** or press '❌ Cancel' to go back.", parse_mode='Markdown')
-
-    else:
-        start_command(message)
+def _polling_retry_delay(error, failures):
+    if isinstance(error, requests.exceptions.ReadTimeout):
+        return POLLING_TIMEOUT_RETRY_SECONDS, failures
+    return min(POLLING_MAX_BACKOFF_SECONDS, 2 ** failures), failures + 1
 
 if __name__ == "__main__":
-    logging.info("Initializing database...")
+    logger.info("Initializing database...")
     create_database()
     insert_sample_data()
-    logging.info("Bot is starting to poll for messages...")
+    start_feedback_workers()
+    logger.info("Bot is starting to poll for messages...")
 
+    failures = 0
     while True:
+        started_at = time.monotonic()
         try:
-            bot.polling(none_stop=True)
+            bot.polling(non_stop=True)
+            failures = 0
         except Exception as e:
-            logging.critical(f"Bot polling failed with a critical error: {e}")
+            if time.monotonic() - started_at >= POLLING_HEALTHY_SECONDS:
+                failures = 0
+            delay, failures = _polling_retry_delay(e, failures)
+            logger.critical("Bot polling failed with a critical error (%s): %s", type(e).__name__, e)
             bot.stop_polling()
-            time.sleep(15)
-            logging.info("Restarting bot polling...")
\ No newline at end of file
+            logger.warning("Restarting bot polling in %ss (consecutive failures: %s)...", delay, failures)
+            time.sleep(delay)
\ No newline at end of file